@@ -4,17 +4,22 @@
 :py:meth:`FileManager.add` is used to tag a set of file paths filtered based on different inclusion and exclusion criteria.
 :py:meth:`FileManager.__getitem__` is used to retrieve file paths of interest based on a tag, filename, or pattern.
 :py:func:`find` is the core function for finding files, and it is based on `os.walk` and `fnmatch`.
+:py:func:`compile_query` compiles query expressions such as ``ext in (avi, mp4) and not dir 'backup' and size > 100MB``.
 """
 
 from __future__ import annotations
 
 import fnmatch
+import heapq
+import operator
 import os
+import re
+from collections import OrderedDict
 from pathlib import Path
 from typing import Callable, Iterable, Mapping, Union
 
 __version__ = "1.1.0"
-__all__ = ["FileManager", "find"]
+__all__ = ["FileManager", "find", "compile_query", "Query", "partition"]
 
 
 class FileManager:
@@ -35,6 +40,9 @@ class FileManager:
         _filters (dict): {Tag: pattern list}
         _inclusions (dict): {Tag: inclusion criteria}
         _exclusions (dict): {Tag: exclusion criteria}
+        _queries (dict): {Tag: query expression}
+        _ext_index (dict): {extension: List of file paths}, built from all_files on demand
+        _filter_cache (OrderedDict): {pattern: List of file paths}, least recently used first
 
     IGNORE:
     Methods:
@@ -48,6 +56,8 @@ class FileManager:
     IGNORE
     """
 
+    _filter_cache_size = 128  # maximum number of patterns in the result cache of FileManager.filter
+
     def __init__(self, base_dir: str, exclude_hidden: bool = True):
         assert isinstance(base_dir, (str, Path))
         self.base_dir = os.path.realpath(base_dir)
@@ -55,6 +65,9 @@ class FileManager:
         self._filters = {}
         self._inclusions = {}
         self._exclusions = {}
+        self._queries = {}
+        self._ext_index = None
+        self._filter_cache = OrderedDict()
         assert isinstance(exclude_hidden, bool)
         self._exclude_hidden = exclude_hidden
 
@@ -65,6 +78,7 @@ class FileManager:
         include: Union[str, list[str]] = None,
         exclude: Union[str, list[str]] = None,
         exclude_hidden: bool = None,
+        query: Union[str, Query] = None,
     ) -> FileManager:
         """Add files based on different inclusion and exclusion criteria.
         Call this method without any arguments to work with all the files in the directory using `FileManager.__getitem__`.
@@ -77,20 +91,28 @@ class FileManager:
             Add all files under the tag `all` (special case)\n
             ``fm = FileManager(r'C:\\videos').add()``
 
+            Add large videos that are not in a backup folder in a single walk\n
+            ``fm.add('large', query="ext in (avi, mp4) and not dir 'backup' and size > 100MB")``
+
         Args:
             tag (str, optional): e.g. 'video_files'. Defaults to all, meaning add all files in the directory recursively.
-            pattern_list (Union[str,list], optional): e.g. '*.avi', ['*.avi', '*.mp4']. Defaults to *.*
+            pattern_list (Union[str,list], optional): e.g. '*.avi', ['*.avi', '*.mp4']. Defaults to *.*, or * when a query is supplied with a tag other than all and *.ext.
             include (Union[str,list], optional): Keep file paths that contain **all** of the supplied strings *anywhere* in the file path. Defaults to None.
             exclude (Union[str,list], optional): Disregard file paths that contain **any** of the supplied string anywhere in the file path. Defaults to None.
             exclude_hidden (bool, optional): Set the state for excluding hidden files. Defaults to the value of _exclude_hidden attribute, which defaults to True.
+            query (Union[str,Query], optional): Query expression (see `compile_query`) that file paths must satisfy.
+                When supplied, the patterns, inclusions, exclusions and the query are evaluated during a single walk,
+                and directories that cannot contain a match are not visited. Defaults to None.
 
         Returns:
             FileManager: Returns self. Useful for chaining commands.
         """
         if pattern_list is None:
-            assert tag == "all" or tag.startswith("*.")
+            assert tag == "all" or tag.startswith("*.") or query is not None
             if tag == "all":
                 pattern_list = "*.*"
+            elif not tag.startswith("*."):
+                pattern_list = "*"  # the query does the filtering
             elif tag == "*.*":
                 pattern_list = tag
                 tag = "all"
@@ -120,23 +142,40 @@ class FileManager:
 
         self._files[tag] = []
 
-        for pattern in pattern_list:
-            self._files[tag] += find(
-                pattern, path=self.base_dir, exclude_hidden=exclude_hidden
+        if query is None:
+            for pattern in pattern_list:
+                self._files[tag] += find(
+                    pattern, path=self.base_dir, exclude_hidden=exclude_hidden
+                )
+        else:
+            query = compile_query(query)
+            assert all(isinstance(x, str) for x in list(include) + list(exclude))
+            # patterns, inclusions and exclusions are evaluated in the same walk
+            self._files[tag] = find(
+                "*",
+                path=self.base_dir,
+                exclude_hidden=exclude_hidden,
+                query=query._restrict(pattern_list, include, exclude),
             )
 
         self._filters[tag] = pattern_list
         self._inclusions[tag] = []
         self._exclusions[tag] = []
+        self._queries[tag] = None if query is None else query.text
 
-        for inc_str in include:
-            assert isinstance(inc_str, str)
-            self._include(tag, inc_str)
+        if query is None:
+            for inc_str in include:
+                assert isinstance(inc_str, str)
+                self._include(tag, inc_str)
 
-        for exc_str in exclude:
-            assert isinstance(exc_str, str)
-            self._exclude(tag, exc_str)
+            for exc_str in exclude:
+                assert isinstance(exc_str, str)
+                self._exclude(tag, exc_str)
+        else:
+            self._inclusions[tag] += list(include)
+            self._exclusions[tag] += list(exclude)
 
+        self._invalidate_cache()
         return self  # for chaining commands
 
     def add_by_depth(
@@ -174,7 +213,9 @@ class FileManager:
                 self._filters[tag] = []
                 self._inclusions[tag] = []
                 self._exclusions[tag] = []
+                self._queries[tag] = None
 
+        self._invalidate_cache()
         return self  # for chaining commands
 
     def remove(self, tag: str) -> None:
@@ -188,6 +229,7 @@ class FileManager:
         """
         if tag in self._files:
             del self._files[tag]
+            self._invalidate_cache()
         else:
             raise ValueError(f"Unknown type {tag}")
 
@@ -202,6 +244,7 @@ class FileManager:
         assert tag in self._files
         self._files[tag] = [fn for fn in self._files[tag] if inclusion_string in fn]
         self._inclusions[tag].append(inclusion_string)
+        self._invalidate_cache()
 
     def _exclude(self, tag: str, exclusion_string: str):
         """Exclude a set of files from the list. Useful for ignoring files in specific sub-folders.
@@ -214,15 +257,18 @@ class FileManager:
         assert tag in self._files
         self._files[tag] = [fn for fn in self._files[tag] if exclusion_string not in fn]
         self._exclusions[tag].append(exclusion_string)
+        self._invalidate_cache()
 
     def __getitem__(self, key: str) -> list:
         """Retrieve file paths based on -
 
+            (q) query expression (see `compile_query`), e.g. ext in (avi, mp4) and size > 100MB
             (0) `FileManager.filter` method if key has special chacters such as *, ?, !, []
             (1) tag
             (2) exact match for the 'stem' of the file
             (3) key is anywhere in the path
 
+            Try (1) first, then (q) if `key` starts with (, `not`, or a query field. Malformed queries raise a ValueError.
             Try (0) if there are special characters in `key`.
             If not, try (2) only if (1) doesn't return any results,
             and try (3) only if (2) doesn't return any results.
@@ -233,6 +279,15 @@ class FileManager:
         Returns:
             list: List of file paths.
         """
+        # (1) by tag
+        if key in self._files:
+            return self._files[key]
+
+        # (q) evaluate query expressions on all the managed files
+        query = self._is_query(key)
+        if query is not None:
+            return [x for x in self.all_files if query.matches(x, self.base_dir)]
+
         # (0) filter using fnmatch.filter when there are special characters in the key
         if self._has_special_characters(key):
             # prepend a * to the key because the intention is to act on full file paths
@@ -240,10 +295,6 @@ class FileManager:
                 f"*{key}"
             )  # notes*.txt will return notes1.txt and notes2.txt
 
-        # (1) by tag
-        if key in self._files:
-            return self._files[key]
-
         # (2) full-stem search
         all_files = self.all_files
         stem_to_path = {
@@ -259,6 +310,8 @@ class FileManager:
 
     def filter(self, pattern: str) -> list:
         """Filter self.all_files using `fnmatch.filter`.
+        Patterns ending in a plain extension (e.g. *.avi, *notes?.txt) only scan the files with that extension.
+        Results of the most recent patterns are cached until tags are added or removed.
 
         Args:
             pattern (str): e.g. *.avi, *notes?.txt
@@ -266,7 +319,80 @@ class FileManager:
         Returns:
             list: List of file paths.
         """
-        return fnmatch.filter(self.all_files, pattern)
+        if pattern in self._filter_cache:
+            self._filter_cache.move_to_end(pattern)
+            return list(self._filter_cache[pattern])
+
+        ext = self._pattern_extension(pattern)
+        if ext is None:
+            candidates = self.all_files
+        else:
+            candidates = self._get_ext_index().get(ext, [])
+        ret = fnmatch.filter(candidates, pattern)
+
+        self._filter_cache[pattern] = ret
+        if len(self._filter_cache) > self._filter_cache_size:
+            self._filter_cache.popitem(last=False)
+        return list(ret)
+
+    def _get_ext_index(self) -> dict:
+        """Return the extension index of self.all_files, building it if necessary.
+
+        Returns:
+            dict: {extension: List of file paths}. Extensions are normalized using `os.path.normcase`.
+        """
+        if self._ext_index is None:
+            ext_index = {}
+            for file_name in self.all_files:
+                ext = os.path.normcase(_file_extension(file_name))
+                ext_index.setdefault(ext, []).append(file_name)
+            self._ext_index = ext_index
+        return self._ext_index
+
+    def _invalidate_cache(self) -> None:
+        """Clear the extension index and the results cached by `FileManager.filter`. Called whenever tags change."""
+        self._ext_index = None
+        self._filter_cache.clear()
+
+    @classmethod
+    def _pattern_extension(cls, pattern: str) -> Union[str, None]:
+        """Extension that every file matching the pattern must have.
+
+        Args:
+            pattern (str): e.g. *.avi, *notes?.txt, *notes*
+
+        Returns:
+            Union[str,None]: e.g. avi, txt, or None when the extension of the matching files cannot be determined from the pattern.
+        """
+        pattern = os.path.normcase(pattern)
+        if "." not in pattern:
+            return None
+        ext = pattern.rsplit(".", 1)[1]
+        if (
+            not ext
+            or cls._has_special_characters(ext, ("*", "?", "[", "!", "]"))
+            or "/" in ext
+            or os.sep in ext
+        ):
+            return None
+        return ext
+
+    def partition(self, tag: str, n: int, by: str = "size") -> list[list[str]]:
+        """Split the file paths retrieved using `FileManager.__getitem__` into `n` balanced shards for batch processing.
+
+        Example:
+            Distribute videos across 8 workers so that each worker processes a similar number of bytes\n
+            ``shards = fm.partition('videos', 8)``
+
+        Args:
+            tag (str): Any key accepted by `FileManager.__getitem__`, typically a tag.
+            n (int): Number of shards.
+            by (str, optional): One of ('size', 'count', 'directory'). See `partition`. Defaults to 'size'.
+
+        Returns:
+            list[list[str]]: `n` lists of file paths. Some shards are empty when there are fewer than `n` files (or directories).
+        """
+        return partition(self[tag], n, by=by)
 
     def get_tags(self) -> list:
         """Return a list of tags created using the add method.
@@ -333,8 +459,34 @@ class FileManager:
         """
         return any([s in inp for s in spc])
 
+    @staticmethod
+    def _is_query(inp: str) -> Union[Query, None]:
+        """Helper function to detect and compile query expressions in `FileManager.__getitem__`.
+        `inp` is a query expression if it starts with ( or if its first word is a query field or `not`, followed by more words.
+
+        Args:
+            inp (str): e.g. ext in (avi, mp4), (ext == avi or ext == mp4) and size > 5, 143Camera
 
-def find(pattern: str, path: str = None, exclude_hidden: bool = True) -> list:
+        Raises:
+            ValueError: If `inp` is a query expression that cannot be parsed.
+
+        Returns:
+            Union[Query,None]: Compiled query, or None if `inp` is not a query expression.
+        """
+        words = inp.split(None, 1)
+        if not inp.lstrip().startswith("(") and (
+            len(words) < 2 or words[0] not in _QUERY_FIELDS + ("not",)
+        ):
+            return None
+        return compile_query(inp)
+
+
+def find(
+    pattern: str,
+    path: str = None,
+    exclude_hidden: bool = True,
+    query: Union[str, Query] = None,
+) -> list:
     """Core function for finding files based on ``os.walk`` and ``fnmatch``.
 
     Example:
@@ -344,6 +496,8 @@ def find(pattern: str, path: str = None, exclude_hidden: bool = True) -> list:
         pattern (str): Input for fnmatch.
         path (str, optional): Search for files in this path. Defaults to the results of os.getcwd().
         exclude_hidden (bool, optional): Whether to include filenames of hidden files. Defaults to True.
+        query (Union[str,Query], optional): Query expression (see `compile_query`) that file paths must satisfy.
+            Sub-directories that cannot contain a match are not visited. Defaults to None.
 
     Returns:
         list: List of file names.
@@ -353,12 +507,27 @@ def find(pattern: str, path: str = None, exclude_hidden: bool = True) -> list:
 
     _eh = _get_exclude_hidden_func(exclude_hidden)
 
+    if query is not None:
+        query = compile_query(query)
+
     result = []
     for root, dirs, files in os.walk(path):
-        result += [
-            os.path.join(root, name) for name in fnmatch.filter(_eh(files), pattern)
-        ]
+        names = fnmatch.filter(_eh(files), pattern)
+        if query is not None:
+            root_dirs = _relative_dirs(path, root)
+            names = [
+                name for name in names if query._match(_Entry(root, root_dirs, name))
+            ]
+        result += [os.path.join(root, name) for name in names]
         dirs[:] = _eh(dirs)
+        if query is not None:
+            dirs[:] = [
+                dir
+                for dir in dirs
+                if not query._prune(
+                    _Entry(os.path.join(root, dir), root_dirs + [dir])
+                )
+            ]
 
     return result
 
@@ -422,7 +591,7 @@ def get_file_sizes(file_list: list, units: str = "MB") -> dict:
     Returns:
         dict: {file_name : size}
     """
-    div = {"B": 1, "KB": 1024, "MB": 1024**2, "GB": 1024**3, "TB": 1024**4}
+    div = _SIZE_UNITS
     if isinstance(file_list, str):
         file_list = [file_list]
     assert isinstance(file_list, list)
@@ -434,6 +603,74 @@ def get_file_sizes(file_list: list, units: str = "MB") -> dict:
     return {size_mb[s]: s for s in size_list}  # {file_name : size}
 
 
+def partition(file_list: list, n: int, by: str = "size") -> list[list[str]]:
+    """Split a list of file paths into `n` balanced shards.
+    Uses the greedy longest-processing-time-first heuristic - the largest remaining item goes to the shard with the smallest total.
+    Ties in the total size (e.g. empty files) go to the shard with the fewest files.
+
+    Example:
+        ``partition(fm['videos'], 8, by='directory')``
+
+    Args:
+        file_list (list): List of file paths.
+        n (int): Number of shards.
+        by (str, optional): Balancing criterion. Defaults to 'size'.
+            'size' balances the total file size of each shard.
+            'count' balances the number of files in each shard, and keeps consecutive (sorted) files together.
+            'directory' balances the total file size of each shard while keeping files from the same directory in the same shard.
+
+    Raises:
+        ValueError: If an unknown balancing criterion is supplied.
+
+    Returns:
+        list[list[str]]: `n` lists of file paths, each sorted.
+    """
+    assert isinstance(n, int) and n > 0
+    file_list = sorted(set(file_list))
+
+    if by == "count":
+        q, r = divmod(len(file_list), n)
+        bounds = [i * q + min(i, r) for i in range(n + 1)]
+        return [file_list[bounds[i] : bounds[i + 1]] for i in range(n)]
+
+    if by == "size":
+        groups = [[f] for f in file_list]
+    elif by == "directory":
+        groups = {}
+        for file_name in file_list:
+            groups.setdefault(os.path.dirname(file_name), []).append(file_name)
+        groups = list(groups.values())
+    else:
+        raise ValueError(f"Unknown partitioning criterion {by}")
+
+    weighted = [(sum(os.path.getsize(f) for f in group), group) for group in groups]
+    weighted.sort(key=lambda x: x[0], reverse=True)  # stable, ties stay in path order
+
+    shards = [[] for _ in range(n)]
+    heap = [(0, 0, i) for i in range(n)]  # (total size, number of files, shard index)
+    for size, group in weighted:
+        total, count, i = heapq.heappop(heap)
+        shards[i] += group
+        heapq.heappush(heap, (total + size, count + len(group), i))
+    return [sorted(shard) for shard in shards]
+
+
+def _file_extension(file_name: str) -> str:
+    """Text after the last . in the file name, or an empty string if there is no . in the name.
+    Used by the query field `ext` and the extension index of `FileManager.filter`, so that `ext == bashrc` and `*.bashrc` agree.
+
+    Args:
+        file_name (str): e.g. C:\\videos\\notes\\notes1.txt, .bashrc
+
+    Returns:
+        str: e.g. txt, bashrc
+    """
+    name = os.path.basename(file_name)
+    if "." not in name:
+        return ""
+    return name.rsplit(".", 1)[1]
+
+
 def _exclude_hidden(name_list: list[str]) -> list[str]:
     """Exclude names of hidden files / folders
 
@@ -464,3 +701,395 @@ def _get_exclude_hidden_func(exclude_hidden: bool = True) -> Callable:
     if exclude_hidden:
         return _exclude_hidden
     return lambda x: x
+
+
+_SIZE_UNITS = {"B": 1, "KB": 1024, "MB": 1024**2, "GB": 1024**3, "TB": 1024**4}
+
+_QUERY_FIELDS = ("ext", "name", "stem", "path", "dir", "size")
+
+_QUERY_TOKEN = re.compile(
+    r"""\s*(?:(?P<str>'[^']*'|"[^"]*")|(?P<op><=|>=|==|!=|<|>|=)|(?P<punc>[(),])|(?P<word>[^\s(),'"<>=!]+))"""
+)
+
+_SIZE_LITERAL = re.compile(r"^(\d+(?:\.\d+)?)([a-zA-Z]*)$")
+
+_COMPARISONS = {
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+    "==": operator.eq,
+    "=": operator.eq,
+    "!=": operator.ne,
+}
+
+
+class Query:
+    """Compiled query expression. Create instances using `compile_query`.
+
+    Attributes:
+        text (str): The query expression that was compiled.
+    """
+
+    def __init__(self, text: str, root: _Node):
+        self.text = text
+        self._root = root
+
+    def matches(self, file_path: str, base_dir: str = None) -> bool:
+        """Evaluate the query on a file path.
+
+        Args:
+            file_path (str): Full path to a file.
+            base_dir (str, optional): `dir` predicates are evaluated on the directories of `file_path` below `base_dir`.
+                Defaults to None, meaning all the directories in `file_path`.
+
+        Returns:
+            bool: True if the file path satisfies the query.
+        """
+        root, name = os.path.split(file_path)
+        if base_dir is None:
+            base_dir = os.path.splitdrive(root)[0] + os.sep
+        return self._match(_Entry(root, _relative_dirs(base_dir, root), name))
+
+    def _match(self, entry: _Entry) -> bool:
+        return self._root.match(entry)
+
+    def _prune(self, dir_entry: _Entry) -> bool:
+        """True if no file in the directory `dir_entry`, or its sub-directories, can satisfy the query."""
+        return self._root.prune(dir_entry)
+
+    def _restrict(
+        self,
+        pattern_list: Iterable[str],
+        include: Iterable[str] = (),
+        exclude: Iterable[str] = (),
+    ) -> Query:
+        """Return a query that additionally requires the file name to match one of the fnmatch patterns,
+        the file path to contain all the strings in `include`, and none of the strings in `exclude`.
+        """
+        operands = [_Predicate("name", "like", tuple(pattern_list)), self._root]
+        operands += [_Predicate("path", "has", (x,)) for x in include]
+        operands += [_Not(_Predicate("path", "has", (x,))) for x in exclude]
+        return Query(self.text, _And(operands))
+
+    def __repr__(self) -> str:
+        return f"Query({self.text!r})"
+
+
+def compile_query(query: Union[str, Query]) -> Query:
+    """Compile a query expression into a single matcher.
+
+    Example:
+        ``compile_query("ext in (avi, mp4) and path has 'canon' and not dir 'backup' and size > 100MB")``
+
+    Fields:
+        ext, name, stem, path: compared using ``==``, ``!=``, ``in (a, b)``, ``has 'substring'``, or ``like 'fnmatch pattern'``.
+        dir: same as above, true if *any* directory below the search path satisfies it. ``dir 'backup'`` is short for ``dir == 'backup'``.
+            Negations apply to the whole directory list: ``dir != backup`` is the same as ``not dir backup``,
+            and is true only if *no* directory is named backup. So canon/backup/b.avi does not match ``dir != backup``.
+            Likewise, ``not dir in (backup, tmp)`` is true only if no directory is named backup or tmp.
+        size: compared using ``<``, ``<=``, ``>``, ``>=``, ``==``, ``!=`` with a size such as 100, 100KB, or 1.5GB.
+
+    Predicates are combined using ``and``, ``or``, ``not``, and parentheses.
+    Directory-level predicates (``dir`` and ``path has``) are used to skip sub-directories during the walk,
+    and ``size`` predicates are evaluated last because they need to read file metadata.
+
+    Args:
+        query (Union[str,Query]): Query expression. A compiled query is returned as is.
+
+    Raises:
+        ValueError: If the query expression cannot be parsed.
+
+    Returns:
+        Query: Compiled query.
+    """
+    if isinstance(query, Query):
+        return query
+    assert isinstance(query, str)
+    return Query(query, _QueryParser(query).parse())
+
+
+class _Entry:
+    """File (or directory, when name is empty) seen during the walk. Metadata is read lazily."""
+
+    __slots__ = ("root", "dir", "name", "_size")
+
+    def __init__(self, root: str, dir: list[str], name: str = ""):
+        self.root = root
+        self.dir = dir  # directories of root below the search path, see _relative_dirs
+        self.name = name
+        self._size = None
+
+    @property
+    def path(self) -> str:
+        if not self.name:
+            return self.root
+        return os.path.join(self.root, self.name)
+
+    @property
+    def stem(self) -> str:
+        return os.path.splitext(self.name)[0]
+
+    @property
+    def ext(self) -> str:
+        return _file_extension(self.name)
+
+    @property
+    def size(self) -> int:
+        if self._size is None:
+            self._size = os.path.getsize(self.path)
+        return self._size
+
+
+def _relative_dirs(base: str, root: str) -> list[str]:
+    """Names of the directories in root below base, e.g. ['canon', 'backup']."""
+    rel = os.path.relpath(root, base)
+    if rel == os.curdir:
+        return []
+    return rel.split(os.sep)
+
+
+class _Node:
+    """Node of a compiled query.
+
+    match: True if the file entry satisfies the query.
+    prune: True if no file under the directory entry can satisfy the query.
+    accept_all: True if every file under the directory entry satisfies the query.
+    cost: Relative cost of match, used to order the evaluation of and/or operands.
+    """
+
+    cost = 0
+
+    def match(self, entry: _Entry) -> bool:
+        raise NotImplementedError
+
+    def prune(self, dir_entry: _Entry) -> bool:
+        return False
+
+    def accept_all(self, dir_entry: _Entry) -> bool:
+        return False
+
+
+class _And(_Node):
+    def __init__(self, operands: list[_Node]):
+        self.operands = sorted(operands, key=lambda x: x.cost)
+        self.cost = max(x.cost for x in operands)
+
+    def match(self, entry):
+        return all(x.match(entry) for x in self.operands)
+
+    def prune(self, dir_entry):
+        return any(x.prune(dir_entry) for x in self.operands)
+
+    def accept_all(self, dir_entry):
+        return all(x.accept_all(dir_entry) for x in self.operands)
+
+
+class _Or(_Node):
+    def __init__(self, operands: list[_Node]):
+        self.operands = sorted(operands, key=lambda x: x.cost)
+        self.cost = max(x.cost for x in operands)
+
+    def match(self, entry):
+        return any(x.match(entry) for x in self.operands)
+
+    def prune(self, dir_entry):
+        return all(x.prune(dir_entry) for x in self.operands)
+
+    def accept_all(self, dir_entry):
+        return any(x.accept_all(dir_entry) for x in self.operands)
+
+
+class _Not(_Node):
+    def __init__(self, operand: _Node):
+        self.operand = operand
+        self.cost = operand.cost
+
+    def match(self, entry):
+        return not self.operand.match(entry)
+
+    def prune(self, dir_entry):
+        return self.operand.accept_all(dir_entry)
+
+    def accept_all(self, dir_entry):
+        return self.operand.prune(dir_entry)
+
+
+class _Predicate(_Node):
+    """Compare the ext, name, stem, path, or dir of an entry using one of ==, in, has, like."""
+
+    def __init__(self, field: str, op: str, values: tuple[str]):
+        if field == "ext":
+            values = tuple(v[1:] if v.startswith(".") else v for v in values)
+        self.field = field
+        self.op = op
+        self.values = values
+        self._normed = {os.path.normcase(v) for v in values}
+
+    def _test(self, value: str) -> bool:
+        if self.op == "has":
+            return any(v in value for v in self.values)
+        if self.op == "like":
+            return any(fnmatch.fnmatch(value, v) for v in self.values)
+        return os.path.normcase(value) in self._normed  # == and in
+
+    def match(self, entry):
+        if self.field == "dir":
+            return any(self._test(x) for x in entry.dir)
+        return self._test(getattr(entry, self.field))
+
+    def accept_all(self, dir_entry):
+        # files below a directory share its directories, and contain its path
+        if self.field == "dir":
+            return self.match(dir_entry)
+        if self.field == "path" and self.op == "has":
+            return self._test(dir_entry.root)
+        return False
+
+
+class _SizeCompare(_Node):
+    cost = 1
+
+    def __init__(self, op: str, size: float):
+        self.op = op
+        self.size = size
+
+    def match(self, entry):
+        return _COMPARISONS[self.op](entry.size, self.size)
+
+
+class _QueryParser:
+    """Recursive descent parser for query expressions.
+
+    expr      := and_expr ('or' and_expr)*
+    and_expr  := not_expr ('and' not_expr)*
+    not_expr  := 'not' not_expr | '(' expr ')' | predicate
+    predicate := 'size' comparison size | field ('=='|'!='|'in'|'has'|'like') value(s) | 'dir' value
+    """
+
+    _keywords = ("and", "or", "not", "in", "has", "like")
+
+    def __init__(self, text: str):
+        self.text = text
+        self.tokens = self._tokenize(text)
+        self.pos = 0
+
+    def _tokenize(self, text: str) -> list[tuple[str, str]]:
+        tokens, pos = [], 0
+        while text[pos:].strip():
+            m = _QUERY_TOKEN.match(text, pos)
+            if m is None:
+                raise ValueError(f"Unable to parse query {text!r} at {text[pos:]!r}")
+            tokens.append((m.lastgroup, m.group(m.lastgroup)))
+            pos = m.end()
+        return tokens
+
+    def _error(self, expected: str):
+        found = "end of query" if self._peek() is None else repr(self._peek()[1])
+        return ValueError(f"Expected {expected} in query {self.text!r}, found {found}")
+
+    def _peek(self) -> tuple[str, str]:
+        if self.pos < len(self.tokens):
+            return self.tokens[self.pos]
+        return None
+
+    def _next(self) -> tuple[str, str]:
+        token = self._peek()
+        if token is None:
+            raise self._error("more tokens")
+        self.pos += 1
+        return token
+
+    def _accept(self, *values: str) -> str:
+        token = self._peek()
+        if token is not None and token[0] != "str" and token[1] in values:
+            self.pos += 1
+            return token[1]
+        return None
+
+    def _expect(self, *values: str) -> str:
+        ret = self._accept(*values)
+        if ret is None:
+            raise self._error(" or ".join(repr(v) for v in values))
+        return ret
+
+    def parse(self) -> _Node:
+        node = self._expr()
+        if self._peek() is not None:
+            raise self._error("'and' or 'or'")
+        return node
+
+    def _expr(self) -> _Node:
+        operands = [self._and_expr()]
+        while self._accept("or"):
+            operands.append(self._and_expr())
+        return operands[0] if len(operands) == 1 else _Or(operands)
+
+    def _and_expr(self) -> _Node:
+        operands = [self._not_expr()]
+        while self._accept("and"):
+            operands.append(self._not_expr())
+        return operands[0] if len(operands) == 1 else _And(operands)
+
+    def _not_expr(self) -> _Node:
+        if self._accept("not"):
+            return _Not(self._not_expr())
+        if self._accept("("):
+            node = self._expr()
+            self._expect(")")
+            return node
+        return self._predicate()
+
+    def _predicate(self) -> _Node:
+        field = self._expect(*_QUERY_FIELDS)
+        if field == "size":
+            op = self._expect(*_COMPARISONS)
+            return _SizeCompare(op, self._size())
+
+        token = self._peek()
+        if field == "dir" and token is not None and self._is_value(token):
+            return _Predicate(field, "==", (self._value(),))
+
+        op = self._expect("==", "=", "!=", "in", "has", "like")
+        if op == "in":
+            return _Predicate(field, op, self._values())
+        if op in ("==", "="):
+            return _Predicate(field, "==", (self._value(),))
+        if op == "!=":
+            return _Not(_Predicate(field, "==", (self._value(),)))
+        return _Predicate(field, op, (self._value(),))
+
+    def _is_value(self, token: tuple[str, str]) -> bool:
+        return token[0] == "str" or (token[0] == "word" and token[1] not in self._keywords)
+
+    def _value(self) -> str:
+        token = self._peek()
+        if token is None or not self._is_value(token):
+            raise self._error("a value")
+        self.pos += 1
+        if token[0] == "str":
+            return token[1][1:-1]
+        return token[1]
+
+    def _values(self) -> tuple[str]:
+        if not self._accept("("):
+            return (self._value(),)
+        values = [self._value()]
+        while self._accept(","):
+            values.append(self._value())
+        self._expect(")")
+        return tuple(values)
+
+    def _size(self) -> float:
+        m = _SIZE_LITERAL.match(self._value())
+        if m is None:
+            raise self._error("a size such as 100MB")
+        number, units = m.groups()
+        if not units:
+            token = self._peek()
+            if token is not None and token[1].upper() in _SIZE_UNITS:
+                units = self._next()[1]
+        units = units.upper() if units else "B"
+        if units not in _SIZE_UNITS:
+            raise ValueError(f"Unknown size units {units!r} in query {self.text!r}")
+        return float(number) * _SIZE_UNITS[units]
@@ -199,3 +199,173 @@ def test_get_file_sizes(tmp_path_factory):
     assert (
         list(pyfilemanager.get_file_sizes(str(fname)).values())[0] == 0
     )  # testing when file_list is a string
+
+
+def test_add_query(tmp_path_factory):
+    fm = FileManager(tmp_path_factory.getbasetemp())
+    fm.add("videos", query="ext in (avi, mp4)")
+    assert len(fm["videos"]) == 8
+    fm.add("canon", "*Camera.avi", query="path has 'canon'")
+    assert _relative_paths(fm["canon"]) == {"canon/40Camera.avi", "canon/51Camera.avi"}
+    fm.add(
+        "pana", query="dir like 'panasonic*' and not dir panasonic2 and ext != txt"
+    )
+    assert _relative_paths(fm["pana"]) == {
+        "panasonic/151Camera.avi",
+        "panasonic/143Camera.avi",
+    }
+    fm.add("empty", query="size > 1KB or (name == '202.mp4' and size >= 1 MB)")
+    assert fm["empty"] == []
+    assert fm._queries["empty"] == "size > 1KB or (name == '202.mp4' and size >= 1 MB)"
+    assert fm._queries["canon"] == "path has 'canon'"
+    # query expressions via __getitem__
+    assert _relative_paths(fm["stem like '*Camera' and not dir in (sony, canon)"]) == {
+        "panasonic/151Camera.avi",
+        "panasonic/143Camera.avi",
+        "panasonic2/201Camera.avi",
+    }
+    assert len(fm["size == 0"]) == 8
+    assert len(fm["(ext == avi or ext == mp4) and not dir canon"]) == 6
+    for bad_query in (
+        "size > 100 XB",
+        "ext in (avi, mp4",
+        "name like [!a]*",
+        "not a query",
+    ):
+        with pytest.raises(ValueError):
+            fm[bad_query]
+    # plain stems and substrings are not queries
+    assert _relative_paths(fm["143Camera"]) == {
+        "panasonic/143Camera.avi",
+        "sony/143Camera.avi",
+    }
+    assert _relative_paths(fm["panasonic2"]) == {
+        "panasonic2/201Camera.avi",
+        "panasonic2/202.mp4",
+    }
+    # tag shorthand with a query
+    fm.add("*.avi", query="not dir canon")
+    assert _relative_paths(fm["avi"]) == {
+        "sony/142Camera.avi",
+        "sony/143Camera.avi",
+        "panasonic/151Camera.avi",
+        "panasonic/143Camera.avi",
+        "panasonic2/201Camera.avi",
+    }
+    assert fm._filters["avi"] == ["*.avi"]
+    assert "*.avi" not in fm.get_tags()
+    # inclusions and exclusions are part of the query
+    fm.add("sony", "*.avi", include=["sony", "42"], exclude="canon", query="size == 0")
+    assert _relative_paths(fm["sony"]) == {"sony/142Camera.avi"}
+    assert fm._inclusions["sony"] == ["sony", "42"]
+    assert fm._exclusions["sony"] == ["canon"]
+    # tags are retrieved before query expressions
+    fm.add("size > 0", "*.mp4")
+    assert _relative_paths(fm["size > 0"]) == {"panasonic2/202.mp4"}
+
+
+def test_compile_query(tmp_path_factory):
+    path = tmp_path_factory.getbasetemp()
+    query = pyfilemanager.compile_query("not dir canon and not path has 'sony'")
+    assert pyfilemanager.compile_query(query) is query
+    assert query._prune(pyfilemanager._Entry(str(path / "canon"), ["canon"]))
+    assert query._prune(pyfilemanager._Entry(str(path / "sony"), ["sony"]))
+    assert not query._prune(pyfilemanager._Entry(str(path / "notes"), ["notes"]))
+    assert len(pyfilemanager.find("*.*", path=path, query=query)) == 7
+    assert query.matches(str(path / "notes" / "notes1.txt"), str(path))
+    # negated dir predicates require that no directory satisfies the predicate
+    backup_file = str(path / "canon" / "backup" / "b.avi")
+    not_backup = pyfilemanager.compile_query("dir != backup")
+    assert not not_backup.matches(backup_file, str(path))
+    assert pyfilemanager.compile_query("dir != sony").matches(backup_file, str(path))
+    # ext is the text after the last ., as in FileManager.filter
+    bashrc = pyfilemanager.compile_query("ext == bashrc")
+    assert bashrc.matches(str(path / ".bashrc"))
+    for bad_query in (
+        "ext",
+        "size > big",
+        "size > 1XB",
+        "ext in (avi",
+        "color == red",
+        "ext == avi mp4",
+    ):
+        with pytest.raises(ValueError):
+            pyfilemanager.compile_query(bad_query)
+
+
+def test_filter_cache(tmp_path_factory):
+    fm = FileManager(tmp_path_factory.getbasetemp())
+    fm.add("videos", ["*.avi", "*.mp4"])
+    fm.add("notes", "notes*.txt")
+    assert fm._pattern_extension("*notes?.txt") == "txt"
+    assert fm._pattern_extension("*notes*") is None
+    assert fm._pattern_extension("*[.]avi") is None
+    assert fm._pattern_extension("*.a?i") is None
+    assert len(fm.filter("*.avi")) == 7
+    assert set(fm._get_ext_index()) == {"avi", "mp4", "txt"}
+    assert _relative_paths(fm["*notes?.txt"]) == {
+        "notes/notes1.txt",
+        "notes/notes2.txt",
+    }
+    assert list(fm._filter_cache) == ["*.avi", "**notes?.txt"]
+    fm.filter("*.avi").clear()  # results are copies of the cached list
+    assert len(fm.filter("*.avi")) == 7
+    assert list(fm._filter_cache) == ["**notes?.txt", "*.avi"]
+    assert len(fm.filter("*Camera*")) == 7
+    # changing tags invalidates the cache
+    fm.remove("videos")
+    assert fm._ext_index is None and not fm._filter_cache
+    assert fm.filter("*.avi") == []
+    fm.add("*.avi")
+    assert len(fm.filter("*.avi")) == 7
+    # least recently used patterns are dropped
+    fm._filter_cache_size = 2
+    fm.filter("*1.txt")
+    fm.filter("*2.txt")
+    assert list(fm._filter_cache) == ["*1.txt", "*2.txt"]
+
+
+def test_partition(tmp_path_factory, monkeypatch):
+    sizes = {
+        "sony/142Camera.avi": 50,
+        "sony/143Camera.avi": 10,
+        "panasonic/151Camera.avi": 30,
+        "panasonic/143Camera.avi": 30,
+        "panasonic2/201Camera.avi": 5,
+        "panasonic2/202.mp4": 5,
+        "canon/51Camera.avi": 5,
+        "canon/40Camera.avi": 5,
+    }
+    monkeypatch.setattr(
+        pyfilemanager.os.path, "getsize", lambda f: sizes[_relative_paths([f]).pop()]
+    )
+    fm = FileManager(tmp_path_factory.getbasetemp())
+    fm.add("videos", ["*.avi", "*.mp4"])
+
+    def _sizes(shards):
+        return sorted(sum(sizes[x] for x in _relative_paths(shard)) for shard in shards)
+
+    shards = fm.partition("videos", 2)
+    assert _sizes(shards) == [70, 70]
+    assert sorted(sum(shards, [])) == sorted(fm["videos"])
+
+    shards = fm.partition("videos", 3, by="count")
+    assert [len(x) for x in shards] == [3, 3, 2]
+
+    shards = fm.partition("videos", 2, by="directory")
+    assert _sizes(shards) == [70, 70]
+    assert sorted(len({Path(f).parent for f in shard}) for shard in shards) == [2, 2]
+
+    assert fm.partition("videos", 10, by="directory")[4:] == [[]] * 6
+    with pytest.raises(ValueError):
+        fm.partition("videos", 2, by="name")
+
+
+def test_partition_equal_sizes(tmp_path_factory):
+    """Files of the fixture folder structure are empty, ties must spread across shards"""
+    fm = FileManager(tmp_path_factory.getbasetemp())
+    fm.add("videos", ["*.avi", "*.mp4"])
+    assert [len(x) for x in fm.partition("videos", 3)] == [3, 3, 2]
+    assert [len(x) for x in pyfilemanager.partition(fm["videos"][:4], 2)] == [2, 2]
+    shards = fm.partition("videos", 2, by="directory")
+    assert [len(x) for x in shards] == [4, 4]